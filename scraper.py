@@ -2,12 +2,21 @@ import os
 import json
 import time
 import logging
+import hashlib
+import collections
 import re
-from bs4 import BeautifulSoup
-import requests
+import asyncio
+import threading
+import lxml.html
+import aiohttp
 import zoneinfo
 import tzlocal
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Logging configuration
 logging.basicConfig(
     level=logging.INFO,
@@ -20,114 +29,251 @@ HLTV_ZONEINFO = zoneinfo.ZoneInfo(HLTV_COOKIE_TIMEZONE)
 LOCAL_TIMEZONE_NAME = tzlocal.get_localzone_name()
 LOCAL_ZONEINFO = zoneinfo.ZoneInfo(LOCAL_TIMEZONE_NAME)
 FLARE_SOLVERR_URL = "http://localhost:8191/v1"
+MAX_CONCURRENT_REQUESTS = 10  # Bound in-flight requests so FlareSolverr is not overwhelmed
+CACHE_PATH = "scrape_cache.json"
+CACHE_FLUSH_INTERVAL = 25  # Flush the cache to disk every N scraped URLs
+CONNECTION_POOL_SIZE = 32
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = {502, 503, 504}
 
 TEAM_MAP_FOR_RESULTS = []
 
-def get_parsed_page(url):
+# Static request parts, built once instead of per call
+_HEADERS = {
+    "referer": "https://www.hltv.org/stats",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    # FlareSolverr responses carry the full HLTV page; advertise
+    # compression so they do not cross the wire uncompressed. Only encodings
+    # aiohttp can decode natively — brotli would need an extra dependency.
+    "accept-encoding": "gzip, deflate",
+    "connection": "keep-alive",
+}
+_COOKIES = {"hltvTimeZone": HLTV_COOKIE_TIMEZONE}
+_POST_TEMPLATE = {"cmd": "request.get", "maxTimeout": 60000}
+
+# Compiled once; matching veto lines is done for every parsed match.
+_VETO_RE = re.compile(r"\d+\.\s*(?:removed|picked|was left over)", re.I)
+_VETO_KEYWORDS_RE = re.compile(r"removed|picked|was left over", re.I)
+
+def _class_predicate(name):
+    # Token-accurate class matching, equivalent to BeautifulSoup's class_=
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+_MAPS_SECTION_XPATH = ".//div[%s and %s]" % (_class_predicate("col-6"), _class_predicate("col-7-small"))
+_VETO_BOX_XPATH = ".//div[%s and %s]" % (_class_predicate("standard-box"), _class_predicate("veto-box"))
+_FORMAT_TEXT_XPATH = ".//div[%s and %s]" % (_class_predicate("padding"), _class_predicate("preformatted-text"))
+_PADDING_XPATH = ".//div[%s]" % _class_predicate("padding")
+_MAPHOLDER_XPATH = ".//div[%s]" % _class_predicate("mapholder")
+_MAPNAME_XPATH = ".//div[%s]" % _class_predicate("mapname")
+_RESULTS_XPATH = ".//div[%s]" % _class_predicate("results")
+_RESULTS_LEFT_XPATH = ".//div[%s]" % _class_predicate("results-left")
+_RESULTS_RIGHT_XPATH = ".//span[%s]" % _class_predicate("results-right")
+_HALF_SCORE_XPATH = ".//div[%s]" % _class_predicate("results-center-half-score")
+
+def _find(node, xpath):
+    found = node.xpath(xpath)
+    return found[0] if found else None
+
+async def fetch_page(session, url):
     logging.info(f"Fetching page: {url}")
-    headers = {
-        "referer": "https://www.hltv.org/stats",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-    }
-    cookies = {"hltvTimeZone": HLTV_COOKIE_TIMEZONE}
-    post_body = {"cmd": "request.get", "url": url, "maxTimeout": 60000}
+    post_body = {**_POST_TEMPLATE, "url": url}
 
-    try:
-        response = requests.post(FLARE_SOLVERR_URL, headers=headers, json=post_body)
-        response.raise_for_status()
-        json_response = response.json()
-        if json_response.get("status") == "ok":
-            html = json_response["solution"]["response"]
-            logging.info(f"Successfully fetched page: {url}")
-            return BeautifulSoup(html, "lxml")
-        else:
-            logging.error(f"Failed to fetch page: {url}, status: {json_response.get('status')}")
-    except requests.RequestException as e:
-        logging.error(f"Error making HTTP request for {url}: {e}")
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.post(FLARE_SOLVERR_URL, json=post_body) as response:
+                if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                    logging.warning(f"Got status {response.status} for {url}, retrying")
+                    json_response = None
+                else:
+                    response.raise_for_status()
+                    json_response = await response.json()
+            # Back off outside the response context so the pooled
+            # connection is released during the sleep
+            if json_response is None:
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                continue
+            if json_response.get("status") == "ok":
+                html = json_response["solution"]["response"]
+                logging.info(f"Successfully fetched page: {url}")
+                return html
+            else:
+                logging.error(f"Failed to fetch page: {url}, status: {json_response.get('status')}")
+                return None
+        except aiohttp.ClientResponseError as e:
+            # Anything outside RETRY_STATUSES (e.g. 404/403 for dead match
+            # URLs) is not transient; retrying just costs extra solves
+            logging.error(f"Got status {e.status} for {url}, not retrying")
+            return None
+        except aiohttp.ClientError as e:
+            if attempt < MAX_RETRIES:
+                logging.warning(f"HTTP error for {url}, retrying: {e}")
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                continue
+            logging.error(f"Error making HTTP request for {url}: {e}")
     return None
 
-def parse_match_details(soup, url):
+def _read_json(path):
+    # orjson is considerably faster on the large results/cache files;
+    # fall back to stdlib json when it is not installed.
+    if orjson is not None:
+        with open(path, 'rb') as file:
+            return orjson.loads(file.read())
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def _dumps_json(data, indent=False):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(data, indent=2 if indent else None).encode()
+
+def _write_json(path, data, indent=False):
+    with open(path, 'wb') as file:
+        file.write(_dumps_json(data, indent))
+
+def _load_cache():
+    try:
+        cache = _read_json(CACHE_PATH)
+    except FileNotFoundError:
+        return {"results_hash": None, "pages": {}}
+    except ValueError:
+        logging.warning(f"Could not decode cache file {CACHE_PATH}, starting fresh")
+        return {"results_hash": None, "pages": {}}
+    if "pages" not in cache:
+        # Legacy layout: a bare url -> match_data mapping
+        return {"results_hash": None, "pages": cache}
+    return cache
+
+def _save_cache(cache):
+    tmp_path = CACHE_PATH + ".tmp"
+    _write_json(tmp_path, cache)
+    os.replace(tmp_path, CACHE_PATH)
+
+_PARSER_LOCAL = threading.local()
+
+def _html_parser():
+    # lxml parser objects are stateful and must not be shared between the
+    # worker threads running _parse_one, so keep one instance per thread.
+    # Comments and processing instructions are dropped during the parse
+    # itself, so those nodes are never built at all.
+    parser = getattr(_PARSER_LOCAL, "parser", None)
+    if parser is None:
+        parser = lxml.html.HTMLParser(remove_comments=True, remove_pis=True)
+        _PARSER_LOCAL.parser = parser
+    return parser
+
+def _parse_one(html, url):
+    tree = lxml.html.fromstring(html, parser=_html_parser())
+    # Everything parse_match_details needs lives under the maps section, so
+    # hand it just that subtree rather than the whole document.
+    maps_section = _find(tree, _MAPS_SECTION_XPATH)
+    return parse_match_details(maps_section, url)
+
+async def fetch_and_parse(session, semaphore, url):
+    async with semaphore:
+        html = await fetch_page(session, url)
+    if html:
+        # Parsing is CPU-bound; run it in a worker thread so it overlaps
+        # with in-flight requests instead of blocking the event loop.
+        match_data = await asyncio.to_thread(_parse_one, html, url)
+        logging.info(f"Scraped data for {url}: {match_data}")
+        return url, match_data
+    logging.warning(f"Failed to parse page for {url}")
+    return url, None
+
+def _extract_team(node):
+    # One walk over the team node instead of separate name and score
+    # lookups; short-circuits when the node is missing entirely.
+    if node is None:
+        return "", "", ()
+    name = ""
+    score = ""
+    for child in node.iterdescendants("div"):
+        classes = child.get("class", "").split()
+        if not name and "results-teamname" in classes:
+            name = child.text_content().strip()
+        elif not score and "results-team-score" in classes:
+            score = child.text_content().strip()
+    return name, score, tuple(node.get("class", "").split())
+
+def parse_match_details(maps_section, url):
     match_data = {"url": url, "format": "", "stage": "", "veto": [], "maps": []}
 
-    # Find the relevant section
-    maps_section = soup.find("div", class_="col-6 col-7-small")
-    if not maps_section:
+    if maps_section is None:
         logging.warning(f"No maps section found for {url}")
         return match_data
 
-    # Log the maps section for debugging
-    logging.debug(f"Maps section HTML for {url}: {maps_section.prettify()[:1000]}...")
+    # Serializing the subtree back to HTML is expensive; only do it when
+    # debug logging is actually enabled
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Maps section HTML for %s: %.1000s...", url, lxml.html.tostring(maps_section, encoding='unicode'))
 
     # Extract match format and stage
-    format_boxes = maps_section.find_all("div", class_="standard-box veto-box")
-    logging.debug(f"Found {len(format_boxes)} veto-box elements for {url}")
+    format_boxes = maps_section.xpath(_VETO_BOX_XPATH)
+    logging.debug("Found %d veto-box elements for %s", len(format_boxes), url)
     for box in format_boxes:
-        format_text = box.find("div", class_="padding preformatted-text")
-        if format_text:
-            lines = [line.strip() for line in format_text.text.split("\n") if line.strip()]
+        format_text = _find(box, _FORMAT_TEXT_XPATH)
+        if format_text is not None:
+            lines = [line.strip() for line in format_text.text_content().split("\n") if line.strip()]
             match_data["format"] = lines[0] if lines else ""
             if len(lines) > 1:
                 stage_text = lines[1].lstrip("* ").strip()
                 match_data["stage"] = stage_text if stage_text else ""
-                logging.debug(f"Extracted format: {match_data['format']}, stage: {match_data['stage']} for {url}")
+                logging.debug("Extracted format: %s, stage: %s for %s", match_data["format"], match_data["stage"], url)
 
     # Extract veto process
     veto_found = False
     for box in format_boxes:
-        veto_div = box.find("div", class_="padding")
-        if veto_div:
-            veto_text = veto_div.text.lower()
-            if any(keyword in veto_text for keyword in ["removed", "picked", "was left over"]):
-                veto_steps = veto_div.find_all("div")
-                match_data["veto"] = [step.text.strip() for step in veto_steps if step.text.strip()]
+        veto_div = _find(box, _PADDING_XPATH)
+        if veto_div is not None:
+            veto_text = veto_div.text_content()
+            if _VETO_KEYWORDS_RE.search(veto_text):
+                veto_steps = veto_div.xpath(".//div")
+                match_data["veto"] = [text for text in (step.text_content().strip() for step in veto_steps) if text]
                 veto_found = True
-                logging.debug(f"Extracted veto steps for {url}: {match_data['veto']}")
+                logging.debug("Extracted veto steps for %s: %s", url, match_data["veto"])
                 break
             else:
-                logging.debug(f"Skipped non-veto div with class='padding' for {url}: {veto_text[:100]}...")
+                logging.debug("Skipped non-veto div with class='padding' for %s: %.100s...", url, veto_text)
 
     if not veto_found:
-        logging.debug(f"Attempting fallback veto extraction for {url}")
-        veto_steps = maps_section.find_all("div", string=re.compile(r"\d+\.\s*(?:removed|picked|was left over)", re.I))
+        logging.debug("Attempting fallback veto extraction for %s", url)
+        veto_steps = [div for div in maps_section.iter("div") if div.text and _VETO_RE.search(div.text)]
         if veto_steps:
-            match_data["veto"] = [step.text.strip() for step in veto_steps if step.text.strip()]
-            logging.debug(f"Fallback veto steps extracted for {url}: {match_data['veto']}")
+            match_data["veto"] = [text for text in (step.text_content().strip() for step in veto_steps) if text]
+            logging.debug("Fallback veto steps extracted for %s: %s", url, match_data["veto"])
         else:
             logging.warning(f"No veto steps found for {url}")
 
     # Extract map results
-    map_holders = maps_section.find_all("div", class_="mapholder")
-    logging.debug(f"Found {len(map_holders)} map holders for {url}")
+    map_holders = maps_section.xpath(_MAPHOLDER_XPATH)
+    logging.debug("Found %d map holders for %s", len(map_holders), url)
     for map_holder in map_holders:
         map_data = {}
         # Map name
-        map_name_div = map_holder.find("div", class_="mapname")
-        map_data["map"] = map_name_div.text.strip() if map_name_div else "Unknown"
+        map_name_div = _find(map_holder, _MAPNAME_XPATH)
+        map_data["map"] = map_name_div.text_content().strip() if map_name_div is not None else "Unknown"
 
         # Team results
-        results = map_holder.find("div", class_="results")
-        if results:
+        results = _find(map_holder, _RESULTS_XPATH)
+        if results is not None:
             # Team 1 (left)
-            team1 = results.find("div", class_="results-left")
-            team1_name = team1.find("div", class_="results-teamname").text.strip() if team1 else ""
-            team1_score = team1.find("div", class_="results-team-score").text.strip() if team1 else ""
-            team1_status = "won" if "won" in team1.get("class", []) else "lost"
+            team1_name, team1_score, team1_cls = _extract_team(_find(results, _RESULTS_LEFT_XPATH))
+            team1_status = "won" if "won" in team1_cls else "lost"
 
             # Team 2 (right)
-            team2 = results.find("span", class_="results-right")
-            team2_name = team2.find("div", class_="results-teamname").text.strip() if team2 else ""
-            team2_score = team2.find("div", class_="results-team-score").text.strip() if team2 else ""
-            team2_status = "won" if "won" in team2.get("class", []) else "lost"
+            team2_name, team2_score, team2_cls = _extract_team(_find(results, _RESULTS_RIGHT_XPATH))
+            team2_status = "won" if "won" in team2_cls else "lost"
 
             # Half-time scores
-            half_scores = results.find("div", class_="results-center-half-score")
-            half_score_text = half_scores.text.strip() if half_scores else ""
+            half_scores = _find(results, _HALF_SCORE_XPATH)
+            half_score_text = half_scores.text_content().strip() if half_scores is not None else ""
 
             # Check if the map was not played
             if team1_score == "-" and team2_score == "-" and not half_score_text:
                 team1_status = "not_played"
                 team2_status = "not_played"
-                logging.debug(f"Detected unplayed map {map_data['map']} for {url}")
+                logging.debug("Detected unplayed map %s for %s", map_data["map"], url)
 
             map_data["team1"] = {
                 "name": team1_name,
@@ -147,68 +293,95 @@ def parse_match_details(soup, url):
             #     continue
 
             map_data["status"] = "played" if half_score_text else "not_played"
-            map_data["map"] = map_data["map"]
-            map_data["team1"] = map_data["team1"]
-            map_data["team2"] = map_data["team2"]
-            map_data["half_scores"] = map_data["half_scores"]
             match_data["maps"].append(map_data)
             
         else:
-            logging.debug(f"No results found for map {map_data['map']} in {url}")
+            logging.debug("No results found for map %s in %s", map_data["map"], url)
 
     return match_data
 
-def update_results_json(json_file_path):
+async def update_results_json(json_file_path):
     # Read the original JSON file
     try:
-        with open(json_file_path, 'r') as file:
-            results_data = json.load(file)
+        results_data = _read_json(json_file_path)
     except FileNotFoundError:
         logging.error(f"JSON file not found: {json_file_path}")
         return
-    except json.JSONDecodeError:
+    except ValueError:
         logging.error(f"Error decoding JSON file: {json_file_path}")
         return
 
-    # Get unique URLs to avoid redundant scraping
-    unique_urls = list(set(match['url'] for match in results_data))
+    # Index rows by URL once; results.json typically repeats the same match
+    # URL across rows, and the index drives both scraping and the merge
+    matches_by_url = collections.defaultdict(list)
+    for match in results_data:
+        matches_by_url[match['url']].append(match)
+    # The index keys are already unique and in first-seen order, which keeps
+    # scraping and logging deterministic run to run
+    unique_urls = list(matches_by_url)
     logging.info(f"Found {len(unique_urls)} unique URLs to scrape")
 
     # Dictionary to store scraped data for each URL
     scraped_data = {}
 
-    # Scrape data for each unique URL
+    # Serve already-scraped URLs from the persistent cache
+    cache = _load_cache()
+    pages = cache["pages"]
     for url in unique_urls:
-        soup = get_parsed_page(url)
-        if soup:
-            match_data = parse_match_details(soup, url)
-            scraped_data[url] = match_data
-            logging.info(f"Scraped data for {url}: {match_data}")
-        else:
-            logging.warning(f"Failed to parse page for {url}")
-            scraped_data[url] = {"url": url, "format": "", "stage": "", "veto": [], "maps": []}
-        #time.sleep(1)  # Delay to avoid rate limiting
+        if url in pages:
+            scraped_data[url] = pages[url]
+    urls_to_fetch = [url for url in unique_urls if url not in scraped_data]
+    logging.info(f"{len(scraped_data)} URLs served from cache, {len(urls_to_fetch)} to scrape")
 
-    # Update each entry in results_data with scraped data
-    for match in results_data:
-        url = match['url']
-        if url in scraped_data:
-            match.update({
-                "format": scraped_data[url]["format"],
-                "stage": scraped_data[url]["stage"],
-                "veto": scraped_data[url]["veto"],
-                "maps": scraped_data[url]["maps"]
-            })
-
-    # Save updated data to a new JSON file
+    # Scrape remaining URLs concurrently, bounded by a semaphore. One session
+    # for the whole run keeps connections to FlareSolverr pooled and alive.
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    connector = aiohttp.TCPConnector(limit=CONNECTION_POOL_SIZE)
+    async with aiohttp.ClientSession(connector=connector, headers=_HEADERS, cookies=_COOKIES) as session:
+        tasks = [fetch_and_parse(session, semaphore, url) for url in urls_to_fetch]
+        scraped_count = 0
+        for task in asyncio.as_completed(tasks):
+            url, match_data = await task
+            if match_data is not None:
+                scraped_data[url] = match_data
+                pages[url] = match_data
+                scraped_count += 1
+                if scraped_count % CACHE_FLUSH_INTERVAL == 0:
+                    _save_cache(cache)
+            else:
+                # Failed fetches are not cached so they get retried next run
+                scraped_data[url] = {"url": url, "format": "", "stage": "", "veto": [], "maps": []}
+
+    # Update each entry in results_data with scraped data, one dict lookup
+    # per unique URL instead of one per row
+    for url, rows in matches_by_url.items():
+        data = scraped_data.get(url)
+        if data is None:
+            continue
+        for match in rows:
+            match["format"] = data["format"]
+            match["stage"] = data["stage"]
+            match["veto"] = data["veto"]
+            match["maps"] = data["maps"]
+
+    # Save updated data to a new JSON file, skipping the write when the
+    # output is byte-identical to the previous run
     output_file = "updated_results.json"
-    with open(output_file, 'w') as f:
-        json.dump(results_data, f, indent=2)
-    logging.info(f"Saved updated results to {output_file}")
+    serialized = _dumps_json(results_data, indent=True)
+    results_hash = hashlib.sha1(serialized).hexdigest()
+    if results_hash == cache["results_hash"] and os.path.exists(output_file):
+        logging.info(f"Results unchanged, keeping existing {output_file}")
+    else:
+        with open(output_file, 'wb') as f:
+            f.write(serialized)
+        logging.info(f"Saved updated results to {output_file}")
+    if scraped_count or results_hash != cache["results_hash"]:
+        cache["results_hash"] = results_hash
+        _save_cache(cache)
 
 def main():
     json_file_path = "results.json"  # Path to your JSON file
-    update_results_json(json_file_path)
+    asyncio.run(update_results_json(json_file_path))
 
 if __name__ == "__main__":
     main()